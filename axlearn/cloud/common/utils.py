@@ -2,14 +2,17 @@
 
 """General-purpose utilities."""
 
+import collections
 import dataclasses
+import functools
 import logging as pylogging
 import os
 import shlex
 import signal
 import subprocess
+import threading
 import uuid
-from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Union
 
 import pkg_resources
 import psutil
@@ -208,13 +211,81 @@ def subprocess_run(argv: Union[str, Sequence[str]], *args, **kwargs) -> subproce
         # pylint: disable-next=subprocess-run-check
         return subprocess.run(argv, *args, **kwargs)
     except subprocess.CalledProcessError as e:
-        # Emit the captured stdout/stderr.
-        error_msg = (
-            f"Command {e.cmd} failed: code={e.returncode}, stdout={e.stdout}, stderr={e.stderr}"
-        )
-        if kwargs.get("capture_output"):
-            logging.error(error_msg)
-        raise ValueError(error_msg) from e  # Re-raise.
+        raise _subprocess_error(e, log=kwargs.get("capture_output")) from e  # Re-raise.
+
+
+def subprocess_run_and_tee(
+    argv: Sequence[str],
+    *,
+    check: bool = True,
+    text: bool = True,
+    max_lines: int = 10_000,
+    max_line_length: int = 10_000,
+    **kwargs,
+) -> subprocess.CompletedProcess:
+    """Runs a command via subprocess.Popen, retaining the tail of its outputs.
+
+    Main differences from `subprocess_run(..., capture_output=True)` are:
+    - Outputs are logged (at debug level) as they are produced.
+    - Only the last `max_lines` lines of stdout and stderr are retained. Lines longer than
+        `max_line_length` are read in chunks of that length, each counting as a line. The retained
+        outputs are thus bounded by `max_lines * max_line_length` characters (or bytes, if
+        text=False) per stream.
+
+    Args:
+        argv: The command, as a sequence of strings.
+        check: If True, raises if the command fails.
+        text: Whether to decode outputs as text.
+        max_lines: Max number of trailing lines to retain per stream.
+        max_line_length: Max number of characters (or bytes) read per line.
+        **kwargs: Forwarded to `subprocess.Popen`.
+
+    Returns:
+        A completed process, whose stdout and stderr contain the retained outputs.
+
+    Raises:
+        ValueError: If check=True and the command fails.
+    """
+    empty = "" if text else b""
+    tails = (collections.deque(maxlen=max_lines), collections.deque(maxlen=max_lines))
+    with subprocess.Popen(
+        argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text, **kwargs
+    ) as proc:
+        readers = [
+            threading.Thread(
+                target=_tee_stream,
+                args=(iter(functools.partial(stream.readline, max_line_length), empty), tail),
+                daemon=True,
+            )
+            for stream, tail in zip((proc.stdout, proc.stderr), tails)
+        ]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        returncode = proc.wait()
+
+    stdout, stderr = (empty.join(tail) for tail in tails)
+    if check and returncode:
+        e = subprocess.CalledProcessError(returncode, argv, output=stdout, stderr=stderr)
+        raise _subprocess_error(e, log=True) from e
+    return subprocess.CompletedProcess(argv, returncode, stdout=stdout, stderr=stderr)
+
+
+def _tee_stream(lines: Iterable, tail: collections.deque):
+    """Logs each of `lines`, retaining the last ones in `tail`."""
+    for line in lines:
+        logging.debug("%s", line.rstrip())
+        tail.append(line)
+
+
+def _subprocess_error(e: subprocess.CalledProcessError, *, log: bool) -> ValueError:
+    """Returns a ValueError describing `e`, also logging it if `log` is True."""
+    # Emit the captured stdout/stderr.
+    error_msg = f"Command {e.cmd} failed: code={e.returncode}, stdout={e.stdout}, stderr={e.stderr}"
+    if log:
+        logging.error(error_msg)
+    return ValueError(error_msg)
 
 
 def canonicalize_to_list(v: Union[str, Sequence[str]], *, delimiter: str = ",") -> List[str]:
@@ -8,6 +8,7 @@ import pathlib
 import shlex
 import signal
 import subprocess
+import sys
 import tempfile
 import time
 from typing import Dict, Sequence, Union
@@ -147,6 +148,29 @@ class UtilsTest(TestWithTemporaryCWD):
             # Ensure that the count is still the same.
             self.assertEqual(_read_count(), count)
 
+    @parameterized.parameters(True, False)
+    def test_subprocess_run_and_tee(self, text: bool):
+        script = "print('\\n'.join(map(str, range(5)))); print('e' * 10, file=sys.stderr)"
+        proc = utils.subprocess_run_and_tee(
+            [sys.executable, "-c", f"import sys; {script}"],
+            text=text,
+            max_lines=2,
+            max_line_length=4,
+        )
+        # Only the tail should be retained. Long lines are read in chunks.
+        expected_stdout, expected_stderr = "3\n4\n", "e" * 6 + "\n"
+        if not text:
+            expected_stdout, expected_stderr = expected_stdout.encode(), expected_stderr.encode()
+        self.assertEqual(0, proc.returncode)
+        self.assertEqual(expected_stdout, proc.stdout)
+        self.assertEqual(expected_stderr, proc.stderr)
+
+        # Failures should raise by default, similar to `subprocess_run`.
+        fail_argv = [sys.executable, "-c", "exit(3)"]
+        with self.assertRaisesRegex(ValueError, "code=3"):
+            utils.subprocess_run_and_tee(fail_argv)
+        self.assertEqual(3, utils.subprocess_run_and_tee(fail_argv, check=False).returncode)
+
     # TODO(tom_gunter,markblee): Understand & fix flakiness on CI.
     @pytest.mark.skip(reason="Passes locally & in docker but fails on CI, to be fixed.")
     def test_copy_blobs(self):
@@ -6,23 +6,30 @@ Note that these utilities do not handle resource management.
 """
 
 import atexit
+import glob
 import logging
 import os
 import pathlib
 import re
 import shlex
+import signal
 import subprocess
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, Sequence, Union
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
 from urllib.parse import urlparse
 
 import kubernetes as k8s
 from absl import flags
 from google.auth.credentials import Credentials
+from google.auth.transport.requests import Request
 
 from axlearn.cloud.common.bundler import BaseDockerBundler
 from axlearn.cloud.common.job import Job
-from axlearn.cloud.common.utils import subprocess_run
+from axlearn.cloud.common.utils import subprocess_run, subprocess_run_and_tee
 from axlearn.cloud.gcp.config import default_project, default_zone, gcp_settings
 from axlearn.cloud.gcp.scopes import DEFAULT_TPU_SCOPES
 from axlearn.cloud.gcp.system_characteristics import USER_FACING_NAME_TO_SYSTEM_CHARACTERISTICS
@@ -42,6 +49,31 @@ from axlearn.cloud.gcp.utils import (
 from axlearn.common.config import REQUIRED, ConfigBase, Required, config_class
 from axlearn.common.utils import Nested
 
+# The gcloud command used to SSH into a TPU-VM, up to the TPU name.
+_TPU_VM_SSH_ARGV = ("gcloud", "alpha", "compute", "-q", "tpus", "tpu-vm", "ssh")
+# gcloud ssh flags which send keepalives, so that idle connections are not silently dropped
+# (e.g. by NAT timeouts) and unresponsive connections fail after ~90s.
+_SSH_KEEPALIVE_FLAGS = ("--ssh-flag=-oServerAliveInterval=30", "--ssh-flag=-oServerAliveCountMax=3")
+# Max number of slices to SSH into concurrently.
+_MAX_SSH_WORKERS = 32
+# Max number of trailing lines (and characters per line) retained from each stream of a gcloud ssh
+# command. With up to `_MAX_SSH_WORKERS` concurrent commands, each retaining stdout and stderr, this
+# bounds captured outputs to ~64M characters in the worst case.
+_MAX_SSH_OUTPUT_LINES = 1_000
+_MAX_SSH_OUTPUT_LINE_LENGTH = 1_000
+# Max number of connections kept by the k8s client used to submit JobSets.
+_K8S_CONNECTION_POOL_MAXSIZE = 32
+# Cached credentials are refreshed if they expire within this window.
+_CREDENTIALS_REFRESH_WINDOW = timedelta(minutes=5)
+# Parses the output of `ssh-agent -s`. See `_start_ssh_agent` for example outputs.
+# Each variable is assigned at the start of its own line, so anchor per line instead of matching
+# across lines.
+_SSH_AGENT_RE = re.compile(r"^(SSH_AUTH_SOCK|SSH_AGENT_PID)=([^;]+);", re.MULTILINE)
+# Maps (project, zone, TPU name) to whether the TPU must be reached via IAP.
+_USE_IAP_CACHE: Dict[Tuple[str, str, str], bool] = {}
+# Pids of processes which have registered `_close_ssh_control_masters` to run at exit.
+_SSH_CONTROL_CLEANUP_PIDS: Set[int] = set()
+
 
 class GCPJob(Job):
     """Base GCP Job definition."""
@@ -71,13 +103,20 @@ class GCPJob(Job):
             **common_kwargs,
         )
 
+    def __init__(self, cfg: Config):
+        super().__init__(cfg)
+        # Maps impersonation scopes to credentials.
+        self._credentials: Dict[Tuple[str, ...], Credentials] = {}
+        self._credentials_lock = threading.Lock()
+
     def _get_job_credentials(
         self,
         impersonate_scopes: Optional[Sequence[str]] = None,
     ) -> Credentials:
         """Returns the credentials the job runs as.
 
-        Note that credentials are temporary and should be created on demand.
+        Credentials are cached per scopes, so that the token is reused across calls. Since
+        credentials are temporary, cached credentials are refreshed when close to expiry.
 
         Args:
             impersonate_scopes: Scopes of the impersonation token,
@@ -86,10 +125,18 @@ class GCPJob(Job):
         Returns:
             The temporary credentials, possibly impersonating `cfg.service_account`.
         """
-        return get_credentials(
-            impersonate_account=self.config.service_account,
-            impersonate_scopes=impersonate_scopes,
-        )
+        key = tuple(impersonate_scopes or ())
+        with self._credentials_lock:
+            credentials = self._credentials.get(key)
+            if credentials is None:
+                credentials = get_credentials(
+                    impersonate_account=self.config.service_account,
+                    impersonate_scopes=impersonate_scopes,
+                )
+                self._credentials[key] = credentials
+            elif _expires_within(credentials, _CREDENTIALS_REFRESH_WINDOW):
+                credentials.refresh(Request())
+        return credentials
 
 
 @config_class
@@ -136,6 +183,9 @@ class TPUQRMJob(GCPJob):
     def __init__(self, cfg: Config):
         super().__init__(cfg)
         self._local_home = pathlib.Path.home()
+        self._hosts_file = self._local_home / ".ssh/google_compute_known_hosts"
+        self._ssh_key = self._local_home / ".ssh/google_compute_engine"
+        self._ssh_key_added = False
         self._use_iap = None  # Infer from public IP.
 
     @classmethod
@@ -152,19 +202,28 @@ class TPUQRMJob(GCPJob):
     def _ensure_ssh_keys(self):
         """Ensures SSH keys exist, or raises ValueError. Only necessary on remote VM."""
         # Seem to need to nuke this every time to avoid MITM warnings.
-        hosts_file = self._local_home / ".ssh/google_compute_known_hosts"
-        if hosts_file.exists():
-            hosts_file.unlink()
-
-        ssh_key = self._local_home / ".ssh/google_compute_engine"
-        proc = subprocess_run(f"ssh-add {ssh_key}", check=False, capture_output=True)
-        if proc.returncode:
-            logging.warning("SSH key %s does not exist yet.", ssh_key)
+        try:
+            os.unlink(self._hosts_file)
+        except FileNotFoundError:
+            pass
+
+        # The key only needs to be added to the ssh-agent once.
+        if not self._ssh_key_added:
+            proc = subprocess_run(["ssh-add", self._ssh_key], check=False, capture_output=True)
+            if proc.returncode:
+                logging.warning("SSH key %s does not exist yet.", self._ssh_key)
+            else:
+                self._ssh_key_added = True
 
     def _infer_iap(self):
         """Infers whether instance has public IP. If not, we tunnel through IAP."""
         if self._use_iap is None:
             cfg: TPUQRMJob.Config = self.config
+            # The result is shared across jobs that reference the same TPU.
+            cache_key = (cfg.project, cfg.zone, cfg.name)
+            if cache_key in _USE_IAP_CACHE:
+                self._use_iap = _USE_IAP_CACHE[cache_key]
+                return self._use_iap
             if cfg.accelerator.num_replicas > 1:
                 node = get_queued_tpu_node(
                     cfg.name,
@@ -181,10 +240,10 @@ class TPUQRMJob(GCPJob):
                 for access_config in endpoint.get("accessConfig", []):
                     if access_config.get("natIP", None):
                         logging.info("Detected a public IP, not using IAP.")
-                        self._use_iap = False
+                        self._use_iap = _USE_IAP_CACHE[cache_key] = False
                         return False
             logging.info("Didn't find a public IP, using IAP.")
-            self._use_iap = True
+            self._use_iap = _USE_IAP_CACHE[cache_key] = True
         return self._use_iap
 
     def _execute_remote_cmd(
@@ -211,7 +270,8 @@ class TPUQRMJob(GCPJob):
             batch_size: Number of concurrent command executions. If 'all', run all commands
                 simultaneously.
             extra_ssh_flags: Extra gcloud ssh flags.
-            **kwargs: Forwarded to subprocess.
+            **kwargs: Forwarded to subprocess. Note that gcloud is always invoked without a shell,
+                i.e. `shell` is ignored.
 
         Returns:
             A list of completed subprocesses. Each corresponds to execution of the command on a
@@ -221,15 +281,19 @@ class TPUQRMJob(GCPJob):
             ValueError: If the name of the detached screen session is too long.
         """
         cfg: TPUQRMJob.Config = self.config
-        from_vm = running_from_vm()
-        cmd = _prepare_cmd_for_gcloud_ssh(f"pushd /root && {cmd}")
-        if from_vm:
+        ssh_flags = [
+            *_ssh_multiplexing_flags(),
+            *_SSH_KEEPALIVE_FLAGS,
+            *shlex.split(extra_ssh_flags),
+        ]
+        if running_from_vm():
             self._ensure_ssh_keys()
-            extra_ssh_flags = f"--internal-ip {extra_ssh_flags}"
+            ssh_flags.insert(0, "--internal-ip")
         elif self._infer_iap():
             # Infer IAP flag if not running from VM.
-            extra_ssh_flags = f"--tunnel-through-iap {extra_ssh_flags}"
-        cmd = f"sudo bash -c {cmd}"
+            ssh_flags.insert(0, "--tunnel-through-iap")
+        # Since gcloud is invoked without a shell, `cmd` only needs to be quoted for `bash -c`.
+        cmd = f"sudo bash -c {shlex.quote(f'pushd /root && {cmd}')}"
         if detached_session:
             # Even though the official limit is 100 chars, screen seems to silently exit even before
             # that.
@@ -241,19 +305,28 @@ class TPUQRMJob(GCPJob):
             slices = [f"{cfg.name}-{i}" for i in range(cfg.accelerator.num_replicas)]
         else:
             slices = [cfg.name]
-        procs = []
-        for s in slices:
-            cmd_for_slice = (
-                f"gcloud alpha compute -q tpus tpu-vm ssh {s} "
-                f"--project={cfg.project} "
-                f"--zone={cfg.zone} "
-                f"--worker={worker} "
-                f"--batch-size={batch_size} "
-                f'{extra_ssh_flags} --command="{cmd}"'
-            )
-            proc = subprocess_run(cmd_for_slice, **_prepare_subprocess_kwargs(kwargs))
-            procs.append(proc)
-        return procs
+        # Only the slice name differs across slices, so build the remaining args once.
+        common_args = [
+            f"--project={cfg.project}",
+            f"--zone={cfg.zone}",
+            f"--worker={worker}",
+            f"--batch-size={batch_size}",
+            *ssh_flags,
+            f"--command={cmd}",
+        ]
+        argv_for_slice = [[*_TPU_VM_SSH_ARGV, s, *common_args] for s in slices]
+
+        # Prepare kwargs once. The read-only view guards against mutation across threads.
+        subprocess_kwargs = types.MappingProxyType(
+            _prepare_subprocess_kwargs(dict(kwargs, shell=False))
+        )
+
+        def run_for_slice(argv: Sequence[str]) -> subprocess.CompletedProcess:
+            return _run_gcloud_ssh(argv, **subprocess_kwargs)
+
+        # SSH to each slice concurrently. `map` preserves the order of `slices`.
+        with ThreadPoolExecutor(max_workers=min(_MAX_SSH_WORKERS, len(slices))) as pool:
+            return list(pool.map(run_for_slice, argv_for_slice))
 
     def _execute(self) -> Any:
         """Performs some computation on remote TPU-VMs."""
@@ -368,8 +441,18 @@ class TPUGKEJob(GKEJob):
         self._tpu_type = infer_tpu_type(cfg.accelerator.instance_type)
         if self._tpu_type not in USER_FACING_NAME_TO_SYSTEM_CHARACTERISTICS:
             raise NotImplementedError(f"Missing system characteristics for {self._tpu_type}")
+        self._system = USER_FACING_NAME_TO_SYSTEM_CHARACTERISTICS[self._tpu_type]
         super().__init__(cfg)
+        cfg = self.config
         self._gcsfuse_volume = "gcs-fuse-csi-ephemeral"
+        # Env var values should always be strings.
+        self._env_list = [dict(name=k, value=str(v)) for k, v in cfg.env_vars.items()]
+        # The bastion scheduling tier, set by `execute`.
+        self._bastion_tier: Optional[str] = None
+        # The most recently built JobSet, along with the bastion tier it was built for.
+        self._jobset: Optional[Tuple[Optional[str], Nested[Any]]] = None
+        # Client used to submit the JobSet. See `_custom_objects_api`.
+        self._jobset_api: Optional[k8s.client.CustomObjectsApi] = None
 
     def _build_container(self) -> Nested[Any]:
         """Builds a config for a single container.
@@ -378,7 +461,7 @@ class TPUGKEJob(GKEJob):
             A nested dict corresponding to a k8s Container config.
         """
         cfg: TPUGKEJob.Config = self.config
-        system = USER_FACING_NAME_TO_SYSTEM_CHARACTERISTICS[self._tpu_type]
+        system = self._system
         volume_mounts = []
 
         if cfg.gcsfuse_mount:
@@ -405,8 +488,7 @@ class TPUGKEJob(GKEJob):
             # TODO(markblee): Improve SIGTERM behavior for command.
             command=["bash", "-c", cfg.command],
             resources=dict(limits={"google.com/tpu": system.chips_per_vm}),
-            # Env var values should always be strings.
-            env=[dict(name=k, value=str(v)) for k, v in cfg.env_vars.items()],
+            env=self._env_list,
             volumeMounts=volume_mounts,
         )
 
@@ -419,7 +501,7 @@ class TPUGKEJob(GKEJob):
             A nested dict corresponding to a k8s Pod template, including the pod metadata and spec.
         """
         cfg: TPUGKEJob.Config = self.config
-        system = USER_FACING_NAME_TO_SYSTEM_CHARACTERISTICS[self._tpu_type]
+        system = self._system
         annotations, selector, volumes = {}, {}, []
 
         if cfg.gcsfuse_mount:
@@ -449,9 +531,8 @@ class TPUGKEJob(GKEJob):
                 )
             )
 
-        # If running from bastion, a scheduling tier will be specified in env.
         # Tier "0" corresponds to reserved; otherwise we use preemptible.
-        tier = os.environ.get("BASTION_TIER", None)
+        tier = self._bastion_tier
         if tier == "0" and cfg.reservation:
             logging.info("Found tier=%s in env. Using reservation=%s", tier, cfg.reservation)
             selector.update({"cloud.google.com/reservation-name": cfg.reservation})
@@ -492,7 +573,7 @@ class TPUGKEJob(GKEJob):
         Returns:
             A nested dict corresponding to a k8s Job config, including the job metadata and spec.
         """
-        system = USER_FACING_NAME_TO_SYSTEM_CHARACTERISTICS[self._tpu_type]
+        system = self._system
         return dict(
             spec=dict(
                 parallelism=system.vms_per_slice,
@@ -534,12 +615,42 @@ class TPUGKEJob(GKEJob):
             ),
         )
 
+    def _get_jobset(self) -> Nested[Any]:
+        """Returns the JobSet config, reusing a previously built one if possible.
+
+        The JobSet only depends on the config and the bastion tier, so it can be reused across
+        retries of `_execute` as long as the tier does not change.
+        """
+        tier = self._bastion_tier
+        if self._jobset is None or self._jobset[0] != tier:
+            self._jobset = (tier, self._build_jobset())
+        return self._jobset[1]
+
+    def _custom_objects_api(self) -> k8s.client.CustomObjectsApi:
+        """Returns the k8s CustomObjectsApi used to submit the JobSet.
+
+        The client is built on first use from the current default k8s config, and reused across
+        retries of `_execute` so that connections can be reused.
+        """
+        if self._jobset_api is None:
+            configuration = k8s.client.Configuration.get_default_copy()
+            configuration.connection_pool_maxsize = _K8S_CONNECTION_POOL_MAXSIZE
+            self._jobset_api = k8s.client.CustomObjectsApi(k8s.client.ApiClient(configuration))
+        return self._jobset_api
+
     def _delete(self):
         cfg: TPUGKEJob.Config = self.config
         # Issues a delete request for the JobSet and proactively delete its descendants. This is not
         # fully blocking; after the call returns there can be a delay before everything is deleted.
         delete_k8s_jobset(cfg.name, namespace=cfg.namespace)
 
+    def execute(self) -> Any:
+        """Wraps _execute with retries, reading the bastion tier from env once per call."""
+        # If running from bastion, a scheduling tier will be specified in env. The bastion may
+        # update the env between calls to `execute`, but not between retries within a call.
+        self._bastion_tier = os.environ.get("BASTION_TIER", None)
+        return super().execute()
+
     def _execute(self) -> Any:
         """Submits a JobSet to the cluster."""
         cfg: TPUGKEJob.Config = self.config
@@ -547,9 +658,9 @@ class TPUGKEJob(GKEJob):
         custom_object = dict(
             apiVersion=f"{api_kwargs['group']}/{api_kwargs['version']}",
             kind="JobSet",
-            **self._build_jobset(),
+            **self._get_jobset(),
         )
-        return k8s.client.CustomObjectsApi().create_namespaced_custom_object(
+        return self._custom_objects_api().create_namespaced_custom_object(
             namespace=cfg.namespace,
             body=custom_object,
             **api_kwargs,
@@ -569,26 +680,33 @@ class CPUJob(GCPJob):
             detached_session: If not None, run commands behind `screen` in detached mode. This is
                 useful for persisting commands even if SSH is terminated. If not None, should be a
                 string containing the session name.
-            **kwargs: Forwarded to subprocess.
+            **kwargs: Forwarded to subprocess. Note that gcloud is always invoked without a shell,
+                i.e. `shell` is ignored.
 
         Returns:
             A subprocess, either live or completed.
         """
         cfg: CPUJob.Config = self.config
         logging.debug("Executing remote command: '%s'", cmd)
-        cmd = _prepare_cmd_for_gcloud_ssh(f"pushd /root && {cmd}")
         # Use login shell. Note `-i` is not interactive.
-        cmd = f"sudo -i bash -c {cmd}"
+        # Since gcloud is invoked without a shell, `cmd` only needs to be quoted for `bash -c`.
+        cmd = f"sudo -i bash -c {shlex.quote(f'pushd /root && {cmd}')}"
         if detached_session:
             cmd = f"sudo screen -dmS {detached_session} {cmd}"
         # Run via screen to persist command after SSH.
-        cmd = (
-            f"gcloud compute -q ssh {cfg.name} "
-            f"--project={cfg.project} "
-            f"--zone={cfg.zone} "
-            f'--command="{cmd}"'
-        )
-        proc = subprocess_run(cmd, **_prepare_subprocess_kwargs(kwargs))
+        cmd = [
+            "gcloud",
+            "compute",
+            "-q",
+            "ssh",
+            cfg.name,
+            f"--project={cfg.project}",
+            f"--zone={cfg.zone}",
+            *_ssh_multiplexing_flags(),
+            *_SSH_KEEPALIVE_FLAGS,
+            f"--command={cmd}",
+        ]
+        proc = _run_gcloud_ssh(cmd, **_prepare_subprocess_kwargs(dict(kwargs, shell=False)))
         logging.debug("Finished launching: '%s'.", cmd)
         return proc
 
@@ -598,6 +716,18 @@ class CPUJob(GCPJob):
         self._execute_remote_cmd(cfg.command)
 
 
+def _expires_within(credentials: Credentials, window: timedelta) -> bool:
+    """Returns whether the credentials' token expires within `window`.
+
+    Credentials without an expiry (e.g. not yet refreshed) are refreshed on first use instead.
+    """
+    expiry = getattr(credentials, "expiry", None)
+    if not isinstance(expiry, datetime):
+        return False
+    # google-auth represents expiry as a naive UTC datetime.
+    return expiry - datetime.utcnow() < window
+
+
 def _prepare_subprocess_kwargs(kwargs: Dict) -> Dict:
     """Enable check=True and capture all outputs by default."""
     kwargs.setdefault("text", True)
@@ -606,11 +736,44 @@ def _prepare_subprocess_kwargs(kwargs: Dict) -> Dict:
     return kwargs
 
 
+def _run_gcloud_ssh(argv: Sequence[str], **kwargs) -> subprocess.CompletedProcess:
+    """Runs a gcloud ssh command.
+
+    Captured outputs are streamed via `subprocess_run_and_tee`, which only retains the tail of
+    stdout and stderr, up to `_MAX_SSH_OUTPUT_LINES` lines of `_MAX_SSH_OUTPUT_LINE_LENGTH`
+    characters each.
+
+    Args:
+        argv: The command, as a sequence of strings.
+        **kwargs: Forwarded to subprocess. Should already be prepared via
+            `_prepare_subprocess_kwargs`.
+
+    Returns:
+        A completed process.
+
+    Raises:
+        ValueError: If check=True and the command fails.
+    """
+    if kwargs.pop("capture_output"):
+        return subprocess_run_and_tee(
+            argv,
+            max_lines=_MAX_SSH_OUTPUT_LINES,
+            max_line_length=_MAX_SSH_OUTPUT_LINE_LENGTH,
+            **kwargs,
+        )
+    return subprocess_run(argv, **kwargs)
+
+
 def _kill_ssh_agent():
     """Terminates ssh-agent, e.g. as started by `_start_ssh_agent`."""
-    subprocess_run("ssh-agent -k", check=False, capture_output=True)
     os.environ.pop("SSH_AUTH_SOCK", None)
-    os.environ.pop("SSH_AGENT_PID", None)
+    agent_pid = os.environ.pop("SSH_AGENT_PID", None)
+    # Equivalent to `ssh-agent -k`, without spawning a subprocess (possibly at exit).
+    if agent_pid:
+        try:
+            os.kill(int(agent_pid), signal.SIGTERM)
+        except ProcessLookupError:
+            pass
 
 
 def _start_ssh_agent():
@@ -627,24 +790,58 @@ def _start_ssh_agent():
         # SSH_AUTH_SOCK=/tmp/ssh-g4aYlFVLLugX/agent.52090; export SSH_AUTH_SOCK;\nSSH_AGENT_PID=52091; export SSH_AGENT_PID;\necho Agent pid 52091;\n
         # Mac:
         # SSH_AUTH_SOCK=/var/folders/j0/blx8mk5j1hlc0k110xsbrxw00000gn/T//ssh-ZAf5XlQX7tWM/agent.7841; export SSH_AUTH_SOCK;\nSSH_AGENT_PID=7842; export SSH_AGENT_PID;\necho Agent pid 7842;\n
-        match = re.search(
-            r"SSH_AUTH_SOCK=([^;]+);.*SSH_AGENT_PID=([^;]+);",
-            process.stdout,
-            re.MULTILINE | re.DOTALL,
-        )
-        auth_sock, agent_pid = match.groups()  # pytype: disable=attribute-error
-        os.environ["SSH_AUTH_SOCK"] = auth_sock
-        os.environ["SSH_AGENT_PID"] = agent_pid
+        agent_env = dict(_SSH_AGENT_RE.findall(process.stdout))
+        os.environ["SSH_AUTH_SOCK"] = agent_env["SSH_AUTH_SOCK"]
+        os.environ["SSH_AGENT_PID"] = agent_env["SSH_AGENT_PID"]
         atexit.register(_kill_ssh_agent)
     logging.info("ssh-agent is running.")
 
 
-def _prepare_cmd_for_gcloud_ssh(cmd: str) -> str:
-    """Handles bash escapes to ensure `cmd` is compatible with gcloud `--command`."""
-    cmd = shlex.quote(cmd)
-    cmd = cmd.replace('"', '\\"')  # Escape double quotes for --command.
-    cmd = cmd.replace("$", r"\$")  # Escape $ for --command.
-    return cmd
+def _ssh_control_path_prefix() -> str:
+    """Returns the prefix of SSH control sockets owned by the current process.
+
+    The first call in each process registers `_close_ssh_control_masters` to run at exit.
+    """
+    pid = os.getpid()
+    # Include the pid so that we never close control masters shared by other processes.
+    prefix = str(pathlib.Path.home() / ".ssh" / f"axlearn-cm-{pid}-")
+    # Forked children inherit the parent's registrations, so track them per pid.
+    if pid not in _SSH_CONTROL_CLEANUP_PIDS:
+        _SSH_CONTROL_CLEANUP_PIDS.add(pid)
+        atexit.register(_close_ssh_control_masters, prefix, pid=pid)
+    return prefix
+
+
+def _close_ssh_control_masters(prefix: str, *, pid: int):
+    """Terminates SSH control masters, e.g. as started via `_ssh_multiplexing_flags`.
+
+    Note that this spawns an `ssh -O exit` subprocess per control master (possibly at exit).
+    """
+    # Skip if registered by a parent process, whose control masters may still be in use.
+    if os.getpid() != pid:
+        return
+    for control_path in glob.glob(f"{glob.escape(prefix)}*"):
+        # The destination is required but unused, since the control path is fully specified.
+        subprocess_run(
+            ["ssh", "-O", "exit", "-o", f"ControlPath={control_path}", "localhost"],
+            check=False,
+            capture_output=True,
+        )
+
+
+def _ssh_multiplexing_flags() -> List[str]:
+    """Returns gcloud ssh flags to reuse SSH connections across commands to the same host.
+
+    The first command to a host starts a control master, which persists for some time after the
+    command completes; subsequent commands skip the connection handshake.
+    """
+    # Use %C (a hash of the connection params) to stay within the unix socket path length limit.
+    control_path = f"{_ssh_control_path_prefix()}%C"
+    return [
+        "--ssh-flag=-oControlMaster=auto",
+        f"--ssh-flag=-oControlPath={control_path}",
+        "--ssh-flag=-oControlPersist=600",
+    ]
 
 
 def docker_command(
@@ -669,11 +866,10 @@ def docker_command(
     Returns:
         The docker command.
     """
-    cmd = _prepare_cmd_for_gcloud_ssh(f"pushd /root && {cmd}")
-    cmd = f"/bin/bash -c {cmd}"
-    env = " ".join([f"-e {e}" for e in (env or [])])
-    volumes = " ".join([f"-v {src}:{dst}" for src, dst in (volumes or {}).items()])
-    extra_docker_flags = " ".join(extra_docker_flags or [])
+    cmd = f"/bin/bash -c {shlex.quote(f'pushd /root && {cmd}')}"
+    env = " ".join(f"-e {e}" for e in (env or ()))
+    volumes = " ".join(f"-v {src}:{dst}" for src, dst in (volumes or {}).items())
+    extra_docker_flags = " ".join(extra_docker_flags or ())
     detached = f"-d --name={detached_session}" if detached_session else ""
     cmd = (
         f"docker run --rm --privileged -u root --network=host {detached} {env} {volumes} "
@@ -13,8 +13,12 @@
 import atexit
 import contextlib
 import os
+import pathlib
+import shlex
 import subprocess
 import sys
+import tempfile
+from datetime import datetime, timedelta
 from typing import Optional, Type, Union
 from unittest import mock
 
@@ -27,7 +31,13 @@ from axlearn.cloud.common.utils import configure_logging, generate_job_name
 from axlearn.cloud.gcp import bundler, job
 from axlearn.cloud.gcp.bundler import ArtifactRegistryBundler, CloudBuildBundler, GCSTarBundler
 from axlearn.cloud.gcp.config import gcp_settings
-from axlearn.cloud.gcp.job import CPUJob, TPUQRMJob, _kill_ssh_agent, _start_ssh_agent
+from axlearn.cloud.gcp.job import (
+    CPUJob,
+    TPUQRMJob,
+    _kill_ssh_agent,
+    _start_ssh_agent,
+    docker_command,
+)
 from axlearn.cloud.gcp.test_utils import mock_gcp_settings
 from axlearn.cloud.gcp.tpu import create_queued_tpu, delete_queued_tpu, infer_tpu_type, qrm_resource
 from axlearn.cloud.gcp.utils import common_flags, get_credentials
@@ -98,6 +108,193 @@ class TPUJobTest(TestCase):
         self.assertIn("axlearn", out.stdout)
 
 
+def _mock_job_config(job_cls: Type[job.GCPJob], **kwargs) -> job.GCPJob.Config:
+    """Returns a config of `job_cls` which runs at most once, for use with mocked gcloud."""
+    return job_cls.default_config().set(
+        name="test-job",
+        project="test-project",
+        zone="test-zone",
+        max_tries=1,
+        retry_interval=1,
+        **kwargs,
+    )
+
+
+class GCPJobTest(TestCase):
+    """Tests GCPJob."""
+
+    def test_get_job_credentials(self):
+        cfg = _mock_job_config(job.GCPJob, service_account="test-sa")
+        gcp_job: job.GCPJob = cfg.instantiate()
+        mock_creds = mock.Mock(expiry=datetime.utcnow() + timedelta(hours=1))
+        # pylint: disable=protected-access
+        with mock.patch(f"{job.__name__}.get_credentials", return_value=mock_creds) as mock_get:
+            # Credentials should be cached per scopes.
+            self.assertIs(mock_creds, gcp_job._get_job_credentials(["a"]))
+            self.assertIs(mock_creds, gcp_job._get_job_credentials(["a"]))
+            self.assertEqual(1, mock_get.call_count)
+            mock_get.assert_called_with(impersonate_account="test-sa", impersonate_scopes=["a"])
+            gcp_job._get_job_credentials()
+            self.assertEqual(2, mock_get.call_count)
+            mock_creds.refresh.assert_not_called()
+
+            # Credentials close to expiry should be refreshed.
+            mock_creds.expiry = datetime.utcnow() + timedelta(minutes=1)
+            self.assertIs(mock_creds, gcp_job._get_job_credentials(["a"]))
+            self.assertEqual(2, mock_get.call_count)
+            mock_creds.refresh.assert_called_once()
+
+
+class TPUQRMJobTest(TestCase):
+    """Tests TPUQRMJob with mocked gcloud."""
+
+    def _job(self, num_replicas: int) -> TPUQRMJob:
+        cfg: TPUQRMJob.Config = _mock_job_config(TPUQRMJob)
+        cfg.accelerator.set(instance_type="tpu-v4-8", num_replicas=num_replicas)
+        return cfg.instantiate()
+
+    @parameterized.parameters(1, 3)
+    def test_execute_remote_cmd(self, num_replicas: int):
+        tpu_job = self._job(num_replicas)
+
+        def mock_subprocess_run(cmd, **kwargs):
+            return subprocess.CompletedProcess(args=cmd, returncode=0, stdout=str(kwargs))
+
+        with mock.patch.multiple(
+            job.__name__,
+            running_from_vm=mock.Mock(return_value=False),
+            subprocess_run=mock.Mock(side_effect=mock_subprocess_run),
+        ), mock.patch.object(tpu_job, "_infer_iap", return_value=False):
+            # pylint: disable-next=protected-access
+            procs = tpu_job._execute_remote_cmd(
+                "echo $HOSTNAME", worker=0, check=False, shell=True, stdout=subprocess.PIPE
+            )
+
+        self.assertEqual(num_replicas, len(procs))
+        if num_replicas > 1:
+            expected_slices = [f"test-job-{i}" for i in range(num_replicas)]
+        else:
+            expected_slices = ["test-job"]
+        # Outputs should be returned in slice order.
+        for proc, expected_slice in zip(procs, expected_slices):
+            self.assertEqual(expected_slice, proc.args[proc.args.index("ssh") + 1])
+            self.assertIn("--worker=0", proc.args)
+            self.assertIn("--ssh-flag=-oControlMaster=auto", proc.args)
+            self.assertIn("--ssh-flag=-oServerAliveInterval=30", proc.args)
+            # The command should be passed as a single arg, without escapes for a local shell.
+            self.assertEqual(
+                "--command=sudo bash -c 'pushd /root && echo $HOSTNAME'", proc.args[-1]
+            )
+            self.assertIn("'check': False", proc.stdout)
+            self.assertIn("'shell': False", proc.stdout)
+
+    @parameterized.parameters(1, 3)
+    def test_execute_remote_cmd_capture_output(self, num_replicas: int):
+        tpu_job = self._job(num_replicas)
+        with mock.patch.multiple(
+            job.__name__,
+            running_from_vm=mock.Mock(return_value=False),
+            subprocess_run=mock.DEFAULT,
+            subprocess_run_and_tee=mock.DEFAULT,
+        ) as mocks, mock.patch.object(tpu_job, "_infer_iap", return_value=False):
+            # pylint: disable-next=protected-access
+            tpu_job._execute_remote_cmd("echo test")
+
+        # Outputs are captured by default, which should stream outputs instead of buffering.
+        mocks["subprocess_run"].assert_not_called()
+        self.assertEqual(num_replicas, mocks["subprocess_run_and_tee"].call_count)
+        for call in mocks["subprocess_run_and_tee"].call_args_list:
+            self.assertEqual(
+                dict(
+                    text=True,
+                    check=True,
+                    shell=False,
+                    # pylint: disable-next=protected-access
+                    max_lines=job._MAX_SSH_OUTPUT_LINES,
+                    # pylint: disable-next=protected-access
+                    max_line_length=job._MAX_SSH_OUTPUT_LINE_LENGTH,
+                ),
+                call.kwargs,
+            )
+
+    def test_ensure_ssh_keys(self):
+        with tempfile.TemporaryDirectory() as temp_dir, mock.patch(
+            "pathlib.Path.home", return_value=pathlib.Path(temp_dir)
+        ):
+            tpu_job = self._job(num_replicas=1)
+            hosts_file = pathlib.Path(temp_dir) / ".ssh/google_compute_known_hosts"
+            hosts_file.parent.mkdir(parents=True)
+            hosts_file.touch()
+            mock_run = mock.Mock(return_value=subprocess.CompletedProcess(args=[], returncode=0))
+            with mock.patch(f"{job.__name__}.subprocess_run", mock_run):
+                tpu_job._ensure_ssh_keys()  # pylint: disable=protected-access
+                self.assertFalse(hosts_file.exists())
+                # Should not fail if the hosts file does not exist.
+                tpu_job._ensure_ssh_keys()  # pylint: disable=protected-access
+            # The key should only be added once.
+            self.assertEqual(1, mock_run.call_count)
+
+    @parameterized.parameters(
+        dict(node={"networkEndpoints": [{"accessConfig": [{"natIP": "1.2.3.4"}]}]}, use_iap=False),
+        dict(node={"networkEndpoints": [{"accessConfig": [{}]}]}, use_iap=True),
+    )
+    def test_infer_iap(self, node: dict, use_iap: bool):
+        mock_get_tpu_node = mock.Mock(return_value=node)
+        # pylint: disable-next=protected-access
+        mock_iap_cache = mock.patch.dict(job._USE_IAP_CACHE, clear=True)
+        with mock_iap_cache, mock.patch.multiple(
+            job.__name__,
+            get_tpu_node=mock_get_tpu_node,
+            tpu_resource=mock.DEFAULT,
+            get_credentials=mock.DEFAULT,
+        ):
+            # pylint: disable-next=protected-access
+            self.assertEqual(use_iap, self._job(num_replicas=1)._infer_iap())
+            # The lookup should be shared with other jobs referencing the same TPU.
+            # pylint: disable-next=protected-access
+            self.assertEqual(use_iap, self._job(num_replicas=1)._infer_iap())
+            self.assertEqual(1, mock_get_tpu_node.call_count)
+
+
+class CPUJobRemoteCmdTest(TestCase):
+    """Tests CPUJob with mocked gcloud."""
+
+    def test_execute_remote_cmd(self):
+        cfg = _mock_job_config(CPUJob)
+        mock_run = mock.Mock(return_value=subprocess.CompletedProcess(args=[], returncode=0))
+        with mock.patch(f"{job.__name__}.subprocess_run", mock_run):
+            # pylint: disable-next=protected-access
+            cfg.instantiate()._execute_remote_cmd(
+                "echo $HOSTNAME", detached_session="test", shell=True, stdout=subprocess.PIPE
+            )
+        (argv,), kwargs = mock_run.call_args
+        self.assertEqual(["gcloud", "compute", "-q", "ssh", "test-job"], argv[:5])
+        self.assertEqual(
+            "--command=sudo screen -dmS test sudo -i bash -c 'pushd /root && echo $HOSTNAME'",
+            argv[-1],
+        )
+        self.assertFalse(kwargs["shell"])
+
+    def test_execute_docker_command(self):
+        cfg = _mock_job_config(CPUJob)
+        cmd = docker_command('echo "$HOME"', image="test-image")
+        mock_run = mock.Mock(return_value=subprocess.CompletedProcess(args=[], returncode=0))
+        with mock.patch(f"{job.__name__}.subprocess_run", mock_run):
+            # pylint: disable-next=protected-access
+            cfg.instantiate()._execute_remote_cmd(cmd, stdout=subprocess.PIPE)
+        (argv,), _ = mock_run.call_args
+        self.assertTrue(argv[-1].startswith("--command="))
+        # Parse the command as the remote shell would.
+        remote_argv = shlex.split(argv[-1][len("--command=") :])
+        self.assertEqual(["sudo", "-i", "bash", "-c"], remote_argv[:4])
+        self.assertEqual(f"pushd /root && {cmd}", remote_argv[4])
+        # Parse the docker command as bash would. The command run in the container should be
+        # unmodified, i.e. without escapes.
+        docker_argv = shlex.split(cmd)
+        self.assertEqual(["test-image", "/bin/bash", "-c"], docker_argv[-4:-1])
+        self.assertEqual('pushd /root && echo "$HOME"', docker_argv[-1])
+
+
 class DummyBastionJob(CPUJob):
     """A dummy CPU job."""
 
@@ -179,6 +376,25 @@ class UtilTest(TestCase):
             os.environ.clear()
             os.environ.update(old_environ)
 
+    def test_ssh_control_path_prefix(self):
+        # pylint: disable=protected-access
+        with mock.patch("os.getpid", return_value=-1), mock.patch(
+            "atexit.register"
+        ) as mock_register, mock.patch(f"{job.__name__}.subprocess_run") as mock_run:
+            prefix = job._ssh_control_path_prefix()
+            self.assertIn("axlearn-cm--1-", prefix)
+            self.assertEqual(prefix, job._ssh_control_path_prefix())
+            # Cleanup should be registered once per process.
+            mock_register.assert_called_once_with(job._close_ssh_control_masters, prefix, pid=-1)
+            # A forked child should register its own cleanup, with a different prefix.
+            with mock.patch("os.getpid", return_value=-2):
+                self.assertNotEqual(prefix, job._ssh_control_path_prefix())
+                self.assertEqual(2, mock_register.call_count)
+                # The child should not close the parent's control masters.
+                with mock.patch("glob.glob", return_value=[f"{prefix}test"]):
+                    job._close_ssh_control_masters(prefix, pid=-1)
+                mock_run.assert_not_called()
+
 
 class TPUGKEJobTest(TestCase):
     @property
@@ -268,9 +484,13 @@ class TPUGKEJobTest(TestCase):
         reservation: Optional[str] = None,
     ):
         with mock.patch.dict("os.environ", env), self._job_config(bundler_cls) as cfg:
-            gke_job: job.TPUGKEJob = cfg.set(reservation=reservation, name="test").instantiate()
+            gke_job: job.TPUGKEJob = cfg.set(
+                reservation=reservation, name="test", max_tries=1, retry_interval=1
+            ).instantiate()
+            # The bastion tier is read from env when the job is executed.
             # pylint: disable-next=protected-access
-            pod_spec = gke_job._build_pod()["spec"]
+            with mock.patch.object(gke_job, "_execute", side_effect=gke_job._build_pod):
+                pod_spec = gke_job.execute()["spec"]
             node_selector = pod_spec["nodeSelector"]
             # The reservation should be used only if scheduled as tier 0.
             if expect_reserved:
@@ -282,6 +502,43 @@ class TPUGKEJobTest(TestCase):
                 self.assertEqual("true", node_selector.get("cloud.google.com/gke-spot", None))
                 self.assertNotIn("cloud.google.com/reservation-name", node_selector)
 
+    def test_get_jobset(self):
+        with self._job_config(ArtifactRegistryBundler) as cfg:
+            gke_job: job.TPUGKEJob = cfg.set(
+                name="test", command="", max_tries=1, retry_interval=1
+            ).instantiate()
+            # pylint: disable=protected-access
+            with mock.patch.object(
+                gke_job, "_build_jobset", side_effect=gke_job._build_jobset
+            ) as mock_build, mock.patch.object(
+                gke_job, "_execute", side_effect=gke_job._get_jobset
+            ):
+                with mock.patch.dict("os.environ", {"BASTION_TIER": "0"}):
+                    jobset = gke_job.execute()
+                    self.assertIs(jobset, gke_job._get_jobset())
+                self.assertEqual(1, mock_build.call_count)
+                # The JobSet should be rebuilt if the tier changes, which is read from env when
+                # the job is executed.
+                with mock.patch.dict("os.environ", {"BASTION_TIER": "1"}):
+                    self.assertIsNot(jobset, gke_job.execute())
+                self.assertEqual(2, mock_build.call_count)
+
+    def test_execute_reuses_client(self):
+        with self._job_config(ArtifactRegistryBundler) as cfg:
+            gke_job: job.TPUGKEJob = cfg.set(
+                name="test", command="", max_tries=2, retry_interval=0
+            ).instantiate()
+            # Fail the first submission, so that the job is retried.
+            mock_create = mock.Mock(side_effect=[ValueError("test"), "created"])
+            with mock.patch(
+                "kubernetes.client.CustomObjectsApi",
+                return_value=mock.Mock(create_namespaced_custom_object=mock_create),
+            ) as mock_api:
+                self.assertEqual("created", gke_job.execute())
+            self.assertEqual(2, mock_create.call_count)
+            # The client should be shared across retries.
+            self.assertEqual(1, mock_api.call_count)
+
 
 if __name__ == "__main__":
     _private_flags()